@@ -15,6 +15,7 @@ import io
 import warnings
 import joblib
 import os
+import tempfile
 
 # 忽略joblib版本警告
 warnings.filterwarnings('ignore', category=UserWarning)
@@ -136,6 +137,41 @@ feature_descriptions = [
     "黏膜相关恒定T细胞(MAIT)的比例 - 本研究的关键标志物"
 ]
 
+# 特征权重（MAIT细胞权重最高）
+feature_weights = [0.071, 0.131, 0.122, 0.072, 0.091, 0.161, 0.150, 0.203]
+
+# ========== 会话状态 ==========
+# 输入值与最近一次预测结果保存在session_state中，切换页面后仍然保留
+for i, default in enumerate(feature_defaults):
+    key = f"feature_{i}"
+    # 重新赋值，防止预测页面未渲染时Streamlit清理控件状态
+    st.session_state[key] = st.session_state.get(key, default)
+
+if "prediction_result" not in st.session_state:
+    st.session_state.prediction_result = None
+
+
+def predict_response(features):
+    """根据8个亚群比例计算响应概率（基于特征值的加权组合）"""
+    rng = np.random.RandomState(123)  # 固定随机种子以获得一致的结果
+
+    weighted_sum = sum(f * w for f, w in zip(features, feature_weights))
+    random_factor = rng.normal(0, 0.05)
+
+    # 计算响应概率（确保在0-1之间）
+    response_probability = float(np.clip(weighted_sum + random_factor, 0, 1))
+
+    # 确定预测类别（阈值设为0.5）
+    threshold = 0.5
+    predicted_class = "R" if response_probability > threshold else "NR"
+
+    return {
+        "features": list(features),
+        "response_probability": response_probability,
+        "nr_probability": 1 - response_probability,
+        "predicted_class": predicted_class,
+    }
+
 # ========== 导入数据 =========
 @st.cache_data  # 缓存数据，避免重复加载
 def load_real_cell_data(csv_path="data/cell_data.csv"):
@@ -160,6 +196,108 @@ def load_real_cell_data(csv_path="data/cell_data.csv"):
     
 
 
+def compute_cell_type_aggregates(df, gene_columns, chunk_size=2048):
+    """
+    一次向量化计算每种细胞类型的聚合统计量
+    返回：细胞类型、基因名、各类型细胞数、基因表达总和、非零表达细胞数
+    """
+    type_codes, cell_types = pd.factorize(df['Cell_Type'], sort=True)
+
+    # 细胞类型指示矩阵（类型数 × 细胞数），通过矩阵乘法一次得到所有类型的聚合结果
+    # Cell_Type缺失的细胞编码为-1，不计入任何类型
+    indicator = np.zeros((len(cell_types), len(df)), dtype=np.float64)
+    labeled = type_codes >= 0
+    indicator[type_codes[labeled], np.flatnonzero(labeled)] = 1.0
+
+    sums = np.zeros((len(cell_types), len(gene_columns)), dtype=np.float64)
+    nonzero = np.zeros_like(sums)
+    # 按细胞分块转换，避免为整个表达矩阵额外生成副本或临时数组
+    for start in range(0, len(df), chunk_size):
+        block = df.iloc[start:start + chunk_size][gene_columns].to_numpy(dtype=np.float64)
+        block_indicator = indicator[:, start:start + chunk_size]
+        sums += block_indicator @ block
+        nonzero += block_indicator @ (block > 0)
+
+    return {
+        "cell_types": np.asarray(cell_types, dtype=str),
+        "genes": np.asarray(gene_columns, dtype=str),
+        "counts": indicator.sum(axis=1),
+        "sums": sums,
+        "nonzero": nonzero,
+    }
+
+
+@st.cache_data  # 每个数据集版本只计算一次
+def load_cell_type_aggregates(csv_path="data/cell_data.csv", csv_mtime=None):
+    """
+    加载细胞类型聚合统计量，结果持久化到CSV同目录下的 *_aggregates.npz
+    csv_mtime 为CSV的修改时间，作为缓存键的一部分：CSV更新后重新读取，
+    且当CSV比缓存文件更新时重新计算
+    """
+    if not os.path.exists(csv_path):
+        return None
+
+    cache_path = os.path.splitext(csv_path)[0] + "_aggregates.npz"
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(csv_path):
+        try:
+            with np.load(cache_path) as cached:
+                return {name: cached[name] for name in cached.files}
+        except Exception:
+            pass  # 缓存文件损坏（如写入被中断），重新计算
+
+    try:
+        # 直接读取CSV，避免使用 load_real_cell_data 中按路径缓存的旧数据
+        df = pd.read_csv(csv_path, index_col=0)
+        if 'Cell_Type' not in df.columns:
+            raise ValueError("数据缺少 'Cell_Type' 列")
+        gene_columns = [col for col in df.columns if col != 'Cell_Type']
+        aggregates = compute_cell_type_aggregates(df, gene_columns)
+    except Exception as e:
+        st.error(f"❌ 计算细胞类型聚合统计量出错: {str(e)}")
+        return None
+
+    # 先写入同目录下的临时文件再替换，避免写入中断留下损坏的缓存文件
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path) or ".",
+                                    prefix=os.path.basename(cache_path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **aggregates)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        st.warning(f"⚠️ 聚合结果缓存写入失败: {str(e)}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return aggregates
+
+
+@st.cache_data  # 只缓存预览行，避免每次重新运行都复制完整表达矩阵
+def load_cell_data_preview(csv_path="data/cell_data.csv", n_rows=10):
+    """加载单细胞数据的前n_rows行及基因列表"""
+    df, gene_columns = load_real_cell_data(csv_path)
+    return df.head(n_rows), gene_columns
+
+
+def rank_marker_genes(aggregates, cell_type, top_n=10):
+    """按该类型平均表达与其余细胞平均表达之差对基因排序"""
+    idx = list(aggregates["cell_types"]).index(cell_type)
+    counts = aggregates["counts"]
+    sums = aggregates["sums"]
+
+    in_mean = sums[idx] / counts[idx]
+    rest_count = counts.sum() - counts[idx]
+    rest_mean = (sums.sum(axis=0) - sums[idx]) / max(rest_count, 1)
+    pct_expressed = aggregates["nonzero"][idx] / counts[idx]
+
+    order = np.argsort(in_mean - rest_mean)[::-1][:top_n]
+    return pd.DataFrame({
+        '基因': aggregates["genes"][order],
+        '类型内平均表达': in_mean[order],
+        '其余细胞平均表达': rest_mean[order],
+        '表达差值': (in_mean - rest_mean)[order],
+        '表达细胞比例': pct_expressed[order],
+    })
+
+
 def generate_mock_dataset_info():
     """数据集信息数据"""
     datasets = pd.DataFrame({
@@ -294,7 +432,7 @@ elif menu == "📊 数据概览":
     # 加载真实单细胞数据
     st.markdown('<h3 class="sub-title">🔬 单细胞数据预览</h3>', unsafe_allow_html=True)
 
-    cell_data, genes = load_real_cell_data("cell_data.csv")  
+    cell_data, genes = load_cell_data_preview("cell_data.csv")  
     
     
     # 显示数据摘要
@@ -313,6 +451,60 @@ elif menu == "📊 数据概览":
     with st.expander("📋 查看数据前10行"):
         st.dataframe(cell_data, use_container_width=True)
     
+    # 细胞类型组成探索（基于预先计算的聚合统计量）
+    st.markdown('<h3 class="sub-title">🧬 细胞类型组成探索</h3>', unsafe_allow_html=True)
+    
+    cell_csv = "cell_data.csv"
+    csv_mtime = os.path.getmtime(cell_csv) if os.path.exists(cell_csv) else None
+    aggregates = load_cell_type_aggregates(cell_csv, csv_mtime)
+    
+    if aggregates is None:
+        st.warning("⚠️ 真实数据文件未找到或无法解析，无法进行细胞类型组成探索。")
+    elif len(aggregates["cell_types"]) == 0:
+        st.warning("⚠️ 数据中没有标注细胞类型（Cell_Type）的细胞，无法进行细胞类型组成探索。")
+    else:
+        cell_types = list(aggregates["cell_types"])
+        gene_list = list(aggregates["genes"])
+        counts = aggregates["counts"]
+        
+        explorer_tabs = st.tabs(["📊 细胞类型比例", "🧪 基因平均表达", "🏷️ 标志基因排名"])
+        
+        with explorer_tabs[0]:
+            proportion_df = pd.DataFrame({
+                '细胞类型': cell_types,
+                '细胞数': counts.astype(int),
+                '比例': counts / counts.sum()
+            })
+            fig = px.bar(proportion_df, x='细胞类型', y='比例', text='细胞数', color='细胞类型')
+            fig.update_layout(showlegend=False, yaxis_tickformat='.0%')
+            st.plotly_chart(fig, use_container_width=True)
+        
+        with explorer_tabs[1]:
+            selected_genes = st.multiselect("选择基因", gene_list, default=gene_list[:5])
+            if selected_genes:
+                gene_index = {gene: i for i, gene in enumerate(gene_list)}
+                cols = [gene_index[gene] for gene in selected_genes]
+                mean_expr = aggregates["sums"][:, cols] / counts[:, None]
+                
+                mean_df = pd.DataFrame(mean_expr, index=cell_types, columns=selected_genes)
+                fig = px.imshow(mean_df, 
+                               labels=dict(x="基因", y="细胞类型", color="平均表达"),
+                               color_continuous_scale="Blues",
+                               aspect="auto")
+                st.plotly_chart(fig, use_container_width=True)
+            else:
+                st.info("💡 请至少选择一个基因。")
+        
+        with explorer_tabs[2]:
+            col1, col2 = st.columns([2, 1])
+            with col1:
+                marker_type = st.selectbox("选择细胞类型", cell_types)
+            with col2:
+                top_n = st.slider("显示基因数", min_value=5, max_value=50, value=10, step=5)
+            
+            marker_df = rank_marker_genes(aggregates, marker_type, top_n)
+            st.dataframe(marker_df, use_container_width=True, hide_index=True)
+    
 
 # ========== 模型预测页面 ==========
 elif menu == "🎯 模型预测":
@@ -335,62 +527,54 @@ elif menu == "🎯 模型预测":
     # 手动输入特征值
     st.markdown('<h3 class="sub-title">📝 输入细胞亚群比例进行预测</h3>', unsafe_allow_html=True)
     
-    # 创建两列布局用于特征输入
-    col1, col2 = st.columns(2)
-    
-    # 存储特征值的字典
-    feature_values = {}
-    
-    with col1:
-        # 前4个特征
-        for i in range(4):
-            feature_values[i] = st.number_input(
-                f"{feature_names[i]}",
-                min_value=0.0,
-                max_value=1.0,
-                value=feature_defaults[i],
-                step=0.01,
-                help=feature_descriptions[i]
-            )
-    
-    with col2:
-        # 后4个特征
-        for i in range(4, 8):
-            feature_values[i] = st.number_input(
-                f"{feature_names[i]}",
-                min_value=0.0,
-                max_value=1.0,
-                value=feature_defaults[i],
-                step=0.01,
-                help=feature_descriptions[i]
-            )
-    
-    # 添加一个说明
-    st.info("💡 **提示**: 所有特征值应在0-1之间，表示该细胞亚群在CD8+T细胞中的比例。")
-    
-    # 预测按钮
-    if st.button("🔍 开始预测", type="primary", use_container_width=True):
-        # 预测结果（基于特征值的加权组合）
-        np.random.seed(123)  # 固定随机种子以获得一致的结果
-        
-        # 提取特征值列表
-        features = [feature_values[i] for i in range(8)]
-        
-        # 计算加权平均值
-        weights = [0.071, 0.131, 0.122, 0.072, 0.091, 0.161, 0.150, 0.203]  # MAIT细胞权重最高
+    # 使用表单：修改输入不会触发重新运行，只有点击预测按钮时才提交
+    with st.form("prediction_form"):
+        # 创建两列布局用于特征输入
+        col1, col2 = st.columns(2)
         
-        weighted_sum = sum(f * w for f, w in zip(features, weights))
-        random_factor = np.random.normal(0, 0.05)
+        with col1:
+            # 前4个特征
+            for i in range(4):
+                st.number_input(
+                    f"{feature_names[i]}",
+                    min_value=0.0,
+                    max_value=1.0,
+                    step=0.01,
+                    help=feature_descriptions[i],
+                    key=f"feature_{i}"
+                )
         
-        # 计算响应概率（确保在0-1之间）
-        response_probability = np.clip(weighted_sum + random_factor, 0, 1)
+        with col2:
+            # 后4个特征
+            for i in range(4, 8):
+                st.number_input(
+                    f"{feature_names[i]}",
+                    min_value=0.0,
+                    max_value=1.0,
+                    step=0.01,
+                    help=feature_descriptions[i],
+                    key=f"feature_{i}"
+                )
         
-        # 确定预测类别（阈值设为0.5）
-        threshold = 0.5
-        predicted_class = "R" if response_probability > threshold else "NR"
+        # 添加一个说明
+        st.info("💡 **提示**: 所有特征值应在0-1之间，表示该细胞亚群在CD8+T细胞中的比例。")
         
-        # 计算NR的概率
-        nr_probability = 1 - response_probability
+        # 预测按钮
+        submitted = st.form_submit_button("🔍 开始预测", type="primary", use_container_width=True)
+    
+    if submitted:
+        # 提取特征值列表并保存预测结果
+        features = [st.session_state[f"feature_{i}"] for i in range(8)]
+        st.session_state.prediction_result = predict_response(features)
+    
+    # 显示最近一次预测结果（切换页面后返回仍然保留）
+    result = st.session_state.prediction_result
+    if result is not None:
+        features = result["features"]
+        weights = feature_weights
+        response_probability = result["response_probability"]
+        nr_probability = result["nr_probability"]
+        predicted_class = result["predicted_class"]
         
         # 显示结果
         st.success("✅ 预测完成！")
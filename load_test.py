@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# load_test.py
+"""
+ICI治疗响应预测系统 —— 并发会话负载测试工具
+
+通过Streamlit的WebSocket协议模拟N个并发的无头会话：
+  - 随机切换导航菜单页面
+  - 在「🎯 模型预测」页面为8个特征输入随机的合法比例（总和为1）并点击「🔍 开始预测」
+最后输出吞吐量、各页面延迟分位数以及服务器内存随时间的增长情况，
+用于评估单实例可服务的并发用户数，并发现 st.cache_data 缓存泄漏。
+
+用法示例：
+    python load_test.py --sessions 20 --duration 60
+    python load_test.py --url ws://localhost:8501 --pid 12345 --sessions 50
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import defaultdict
+
+import numpy as np
+from tornado.websocket import websocket_connect
+
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+# 与 app.py 中的页面及按钮文字保持一致
+PREDICT_PAGE = "🎯 模型预测"
+PREDICT_BUTTON = "🔍 开始预测"
+PREDICT_ACTION = f"{PREDICT_PAGE} · 提交预测"
+NUM_FEATURES = 8
+
+# 与服务器默认的 server.maxMessageSize（200 MB）一致，避免大页面（如完整数据表）断开连接
+MAX_MESSAGE_SIZE = 200 * 1024 * 1024
+
+
+# ========== 服务器管理 ==========
+def port_in_use(port):
+    """检查本地端口是否已被其他进程占用"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        return sock.connect_ex(("localhost", port)) == 0
+
+
+def launch_server(app_path, port):
+    """
+    在本地以无头模式启动Streamlit服务器（工作目录设为应用所在目录，以便按相对路径加载数据）
+    服务器输出写入临时日志文件，返回 (进程, 日志文件路径)
+    """
+    if port_in_use(port):
+        raise RuntimeError(f"端口 {port} 已被占用，请使用 --port 指定其他端口，或通过 --url/--pid 连接已运行的服务器")
+
+    cmd = [
+        sys.executable, "-m", "streamlit", "run", app_path,
+        "--server.headless", "true",
+        "--server.port", str(port),
+        "--browser.gatherUsageStats", "false",
+    ]
+    with tempfile.NamedTemporaryFile(prefix="load_test_server_", suffix=".log", delete=False) as log:
+        server = subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(app_path)),
+                                  stdout=log, stderr=subprocess.STDOUT)
+    return server, log.name
+
+
+def read_log_tail(log_path, max_lines=20):
+    """读取服务器日志的最后几行"""
+    with open(log_path, encoding="utf-8", errors="replace") as f:
+        return "".join(f.readlines()[-max_lines:])
+
+
+def wait_for_server(http_url, server=None, log_path=None, timeout=60):
+    """轮询健康检查接口，直到服务器就绪；本地启动的服务器进程提前退出时报错"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"服务器进程已退出（返回码 {server.returncode}），日志 {log_path}:\n"
+                               f"{read_log_tail(log_path)}")
+        try:
+            with urllib.request.urlopen(f"{http_url}/_stcore/health", timeout=2) as resp:
+                if resp.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"服务器在 {timeout} 秒内未就绪: {http_url}")
+
+
+def read_rss_mb(pid):
+    """读取进程常驻内存（MB），优先使用psutil，否则读取 /proc；进程不存在或已退出时抛出 ProcessLookupError"""
+    try:
+        import psutil
+    except ImportError:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) / 1024
+        except FileNotFoundError:
+            pass
+        # 僵尸进程的 status 中没有 VmRSS
+        raise ProcessLookupError(f"服务器进程 {pid} 不存在或已退出")
+
+    try:
+        process = psutil.Process(pid)
+        if process.status() == psutil.STATUS_ZOMBIE:
+            raise psutil.NoSuchProcess(pid)
+        return process.memory_info().rss / 1024 ** 2
+    except psutil.NoSuchProcess:
+        raise ProcessLookupError(f"服务器进程 {pid} 不存在或已退出")
+
+
+async def sample_memory(pid, interval, samples, stop_event, errors):
+    """定期采样服务器内存；服务器进程退出时记录错误并停止采样"""
+    start = time.monotonic()
+    while True:
+        try:
+            samples.append((time.monotonic() - start, read_rss_mb(pid)))
+        except ProcessLookupError as e:
+            errors.append(f"内存采样: {e}")
+            return
+        if stop_event.is_set():
+            return
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+# ========== 模拟会话 ==========
+def random_proportions(rng):
+    """生成8个随机的合法比例（0-1之间，保留两位小数，总和为1）"""
+    # 最大余数法取整到0.01，保证取整后总和仍为1
+    raw = rng.dirichlet(np.ones(NUM_FEATURES)) * 100
+    cents = np.floor(raw).astype(int)
+    remainder = 100 - cents.sum()
+    cents[np.argsort(cents - raw)[:remainder]] += 1
+    return (cents / 100).tolist()
+
+
+class SimulatedSession:
+    """一个无头浏览器会话：维护控件ID并通过WebSocket触发脚本重新运行"""
+
+    def __init__(self, ws_url, rng):
+        self.ws_url = ws_url
+        self.rng = rng
+        self.conn = None
+        self.menu_id = None
+        self.menu_options = []
+        self.menu_index = 0
+        self.feature_ids = []
+        self.submit_id = None
+
+    async def connect(self):
+        self.conn = await websocket_connect(f"{self.ws_url}/_stcore/stream", subprotocols=["streamlit"],
+                                            max_message_size=MAX_MESSAGE_SIZE)
+        await self.rerun()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+    async def rerun(self, features=None, submit=False):
+        """发送 rerun_script 消息，等待脚本运行结束，返回 (耗时（秒）, 错误信息或None)"""
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        widgets = msg.rerun_script.widget_states.widgets
+
+        if self.menu_id is not None:
+            state = widgets.add()
+            state.id = self.menu_id
+            state.int_value = self.menu_index
+
+        if features is not None:
+            for widget_id, value in zip(self.feature_ids, features):
+                state = widgets.add()
+                state.id = widget_id
+                state.double_value = value
+
+        if submit:
+            state = widgets.add()
+            state.id = self.submit_id
+            state.trigger_value = True
+
+        start = time.perf_counter()
+        await self.conn.write_message(msg.SerializeToString(), binary=True)
+        error = await self._read_until_finished()
+        return time.perf_counter() - start, error
+
+    async def _read_until_finished(self):
+        """读取消息直到脚本运行结束；脚本抛出异常或未正常结束时返回错误信息"""
+        feature_ids = []
+        error = None
+        while True:
+            data = await self.conn.read_message()
+            if data is None:
+                raise ConnectionError("WebSocket连接已被服务器关闭")
+
+            fwd = ForwardMsg()
+            fwd.ParseFromString(data)
+            msg_type = fwd.WhichOneof("type")
+
+            if msg_type == "script_finished":
+                if feature_ids:
+                    self.feature_ids = feature_ids
+                if error is None and fwd.script_finished != ForwardMsg.FINISHED_SUCCESSFULLY:
+                    error = f"脚本未正常结束: {ForwardMsg.ScriptFinishedStatus.Name(fwd.script_finished)}"
+                return error
+            if msg_type != "delta" or fwd.delta.WhichOneof("type") != "new_element":
+                continue
+
+            # 记录控件ID，供后续重新运行时提交控件状态
+            element = fwd.delta.new_element
+            element_type = element.WhichOneof("type")
+            if element_type == "exception" and not element.exception.is_warning and error is None:
+                error = f"{element.exception.type}: {element.exception.message}"
+            elif element_type == "radio" and self.menu_id is None:
+                self.menu_id = element.radio.id
+                self.menu_options = list(element.radio.options)
+            elif element_type == "number_input":
+                feature_ids.append(element.number_input.id)
+            elif element_type == "button" and element.button.label == PREDICT_BUTTON:
+                self.submit_id = element.button.id
+
+    async def step(self):
+        """随机切换一个页面；若进入预测页面则再提交一次预测。返回 [(动作, 耗时, 错误信息)]"""
+        self.menu_index = int(self.rng.integers(len(self.menu_options)))
+        page = self.menu_options[self.menu_index]
+        results = [(page, *await self.rerun())]
+
+        if page == PREDICT_PAGE and len(self.feature_ids) == NUM_FEATURES and self.submit_id:
+            features = random_proportions(self.rng)
+            results.append((PREDICT_ACTION, *await self.rerun(features=features, submit=True)))
+        return results
+
+
+async def run_session(ws_url, seed, deadline, latencies, failures, errors):
+    session = SimulatedSession(ws_url, np.random.default_rng(seed))
+    try:
+        await session.connect()
+        while time.monotonic() < deadline:
+            for action, elapsed, error in await session.step():
+                # 脚本出错的运行不计入延迟统计
+                if error is None:
+                    latencies[action].append(elapsed)
+                else:
+                    failures[action].append(error)
+    except Exception as e:
+        errors.append(f"会话 {seed}: {type(e).__name__}: {e}")
+    finally:
+        session.close()
+
+
+# ========== 报告 ==========
+def print_report(latencies, failures, errors, elapsed, memory_samples, num_sessions):
+    total = sum(len(v) for v in latencies.values())
+    failed = sum(len(v) for v in failures.values())
+    print(f"\n===== 负载测试结果（{num_sessions} 个并发会话，{elapsed:.1f} 秒）=====")
+    print(f"成功交互次数: {total}    吞吐量: {total / elapsed:.2f} 次/秒    "
+          f"脚本出错次数: {failed}    出错会话: {len(errors)}")
+
+    print(f"\n{'动作':<24}{'成功':>8}{'出错':>8}{'p50(ms)':>10}{'p90(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    for action in sorted(set(latencies) | set(failures)):
+        values = np.array(latencies[action]) * 1000
+        if len(values):
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            stats = f"{p50:>10.1f}{p90:>10.1f}{p99:>10.1f}{values.max():>10.1f}"
+        else:
+            stats = f"{'-':>10}" * 4
+        print(f"{action:<24}{len(values):>8}{len(failures[action]):>8}{stats}")
+
+    if memory_samples:
+        print("\n服务器内存（RSS）:")
+        step = max(1, len(memory_samples) // 10)
+        for t, rss in memory_samples[::step]:
+            print(f"  t={t:7.1f}s  {rss:9.1f} MB")
+        first, last = memory_samples[0][1], memory_samples[-1][1]
+        peak = max(rss for _, rss in memory_samples)
+        print(f"  起始 {first:.1f} MB → 结束 {last:.1f} MB（增长 {last - first:+.1f} MB，峰值 {peak:.1f} MB）")
+
+    for action in sorted(failures):
+        if failures[action]:
+            print(f"⚠️ {action} 脚本出错（首个）: {failures[action][0]}")
+    for error in errors[:10]:
+        print(f"⚠️ {error}")
+
+
+async def main(args):
+    server = None
+    log_path = None
+    pid = args.pid
+    ws_url = args.url
+    if ws_url is None:
+        server, log_path = launch_server(args.app, args.port)
+        pid = server.pid
+        ws_url = f"ws://localhost:{args.port}"
+        print(f"服务器日志: {log_path}")
+
+    try:
+        wait_for_server(ws_url.replace("ws://", "http://", 1).replace("wss://", "https://", 1),
+                        server=server, log_path=log_path)
+
+        latencies = defaultdict(list)
+        failures = defaultdict(list)
+        errors = []
+        memory_samples = []
+        stop_event = asyncio.Event()
+        sampler = None
+        if pid is not None:
+            sampler = asyncio.ensure_future(sample_memory(pid, args.memory_interval, memory_samples, stop_event, errors))
+
+        start = time.monotonic()
+        deadline = start + args.duration
+        sessions = []
+        for i in range(args.sessions):
+            sessions.append(asyncio.ensure_future(run_session(ws_url, args.seed + i, deadline, latencies, failures, errors)))
+            # 逐步增加会话，避免所有会话同时建立连接
+            await asyncio.sleep(args.ramp_up / max(args.sessions, 1))
+        await asyncio.gather(*sessions)
+        elapsed = time.monotonic() - start
+
+        stop_event.set()
+        if sampler is not None:
+            await sampler
+
+        print_report(latencies, failures, errors, elapsed, memory_samples, args.sessions)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="模拟并发Streamlit会话对预测系统进行负载测试")
+    parser.add_argument("--app", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"),
+                        help="要启动的Streamlit应用脚本")
+    parser.add_argument("--port", type=int, default=8599, help="本地启动服务器使用的端口")
+    parser.add_argument("--url", default=None,
+                        help="已运行服务器的地址（如 ws://localhost:8501），指定后不再本地启动")
+    parser.add_argument("--pid", type=int, default=None, help="已运行服务器的进程ID，用于内存采样")
+    parser.add_argument("--sessions", type=int, default=10, help="并发会话数")
+    parser.add_argument("--duration", type=float, default=30.0, help="测试持续时间（秒）")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="所有会话建立完成所需时间（秒）")
+    parser.add_argument("--memory-interval", type=float, default=1.0, help="内存采样间隔（秒）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))